@@ -242,6 +242,11 @@ def parse_names(string, pos=messages.Pos.unknown):
 
 _MONTHS = 'January February March April May June July August September October November December'.lower().split()
 
+# Map from every prefix of at least three letters of each month name
+# to that month's number
+_MONTH_LOOKUP = {name[:end]: i + 1 for i, name in enumerate(_MONTHS)
+                 for end in range(3, len(name) + 1)}
+
 def parse_month(string, pos=messages.Pos.unknown):
     """Parse a BibTeX month field.
 
@@ -250,11 +255,10 @@ def parse_month(string, pos=messages.Pos.unknown):
 
     Raises InputError if the field cannot be parsed.
     """
-    val = string.strip().rstrip('.').lower()
-    for i, name in enumerate(_MONTHS):
-        if name.startswith(val) and len(val) >= 3:
-            return i + 1
-    pos.raise_error('invalid month `{}\''.format(string))
+    num = _MONTH_LOOKUP.get(string.strip().rstrip('.').lower())
+    if num is None:
+        pos.raise_error('invalid month `{}\''.format(string))
+    return num
 
 CS_RE = re.compile(r'\\[a-zA-Z]+')
 
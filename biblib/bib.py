@@ -11,20 +11,52 @@ __all__ = 'Parser Entry FieldError resolve_crossrefs'.split()
 import sys
 import re
 import collections
-import textwrap
+import collections.abc
 
 from . import messages
 
 # Match sequences of legal identifier characters, except that the
-# first is not allowed to be a digit (see id_class)
-ID_RE = re.compile('(?![0-9])(?:(?![ \t"#%\'(),={}])[\x20-\x7f])+')
+# first is not allowed to be a digit (see id_class).  NOT_ID_CHARS is
+# a character class of everything else: control characters, space,
+# "#%'(),={}, and non-ASCII characters.  Using plain character classes
+# rather than lookaheads lets the regexp engine test each character
+# against a single set.
+NOT_ID_CHARS = '\\x00-\\x20"#%\'(),={}\\x80-\\U0010ffff'
+ID_RE = re.compile('[^0-9' + NOT_ID_CHARS + '][^' + NOT_ID_CHARS + ']*')
 # BibTeX only considers space, tab, and newline to be white space (see
 # lex_class)
 SPACE_RE = re.compile('[ \t\n]*')
 
+# Fixed tokens used while scanning commands and entries
+NOT_AT_RE = re.compile('[^@]*')
+AT_RE = re.compile('@')
+# The @, type, and opening delimiter of a command or entry, matched
+# together since they almost always appear together.  The delimiter is
+# optional because @comment doesn't need one.
+HEADER_RE = re.compile('@[ \t\n]*(' + ID_RE.pattern + ')[ \t\n]*([{(]?)')
+RPAREN_RE = re.compile('\\)')
+RBRACE_RE = re.compile('}')
+# Database keys end at a comma, white space, or end-of-line, and also
+# at a right brace if the entry is brace-delimited
+KEY_PAREN_RE = re.compile('[^, \t\n]*')
+KEY_BRACE_RE = re.compile('[^, \t}\n]*')
+EQ_RE = re.compile('=')
+COMMA_RE = re.compile(',')
+HASH_RE = re.compile('#')
+DIGITS_RE = re.compile('[0-9]+')
+# Characters of interest when scanning brace-balanced text terminated
+# by the key character
+BALANCED_SPECIAL_RE = {'}': re.compile('[{}]'), '"': re.compile('[{}"]')}
+
+# Number of characters to read at a time when parsing a file
+READ_SIZE = 1 << 20
+
 class ParseError(Exception):
     pass
 
+class _NeedMore(Exception):
+    """Raised when a token may extend past the buffered input."""
+
 class Parser:
     """A parser for .bib BibTeX database files."""
 
@@ -42,7 +74,7 @@ class Parser:
         """
 
         self.__log, self.__errors = [], False
-        self.__entries = collections.OrderedDict()
+        self.__entries = {}
 
         if month_style == 'full':
             self.__macros = {'jan': 'January',   'feb': 'February',
@@ -65,7 +97,7 @@ class Parser:
 
     def string(self, name, value):
         """Declare a macro, just like an @string command."""
-        self.__macros[name] = value
+        self.__macros[sys.intern(name.lower())] = value
 
     def parse(self, str_or_fp_or_iter, name=None, *, log_fp=None):
         """Parse the contents of str_or_fp_or_iter and return self.
@@ -92,9 +124,9 @@ class Parser:
 
         recoverer = messages.InputErrorRecoverer()
         if isinstance(str_or_fp_or_iter, str):
-            self.__data = str_or_fp_or_iter
+            self.__data, self.__fp = str_or_fp_or_iter, None
             fname = name or '<string>'
-        elif isinstance(str_or_fp_or_iter, collections.Iterable) and \
+        elif isinstance(str_or_fp_or_iter, collections.abc.Iterable) and \
              not hasattr(str_or_fp_or_iter, 'read'):
             for obj in str_or_fp_or_iter:
                 with recoverer:
@@ -102,95 +134,183 @@ class Parser:
             recoverer.reraise()
             return self
         else:
-            self.__data = str_or_fp_or_iter.read()
+            # Files are read and parsed a chunk at a time, so we never
+            # hold much more than a chunk and one entry in memory
+            self.__data, self.__fp = '', str_or_fp_or_iter
             try:
                 fname = name or str_or_fp_or_iter.name
             except AttributeError:
                 fname = '<unknown>'
         self.__off = 0
 
-        # Remove trailing whitespace from lines in data (see input_ln
-        # in bibtex.web)
-        self.__data = re.sub('[ \t]+$', '', self.__data, flags=re.MULTILINE)
+        # BibTeX removes trailing whitespace from lines as it reads
+        # them (see input_ln in bibtex.web).  We don't bother: outside
+        # of field values, white space is skipped between tokens and
+        # can't appear in keys or identifiers, and inside field values
+        # runs of white space are compressed anyway (see
+        # _scan_field_value), so the result is the same.
         self.__pos_factory = messages.PosFactory(fname, self.__data, log_fp)
+        self.__warnings = []
 
         # Parse entries
-        while self.__off < len(self.__data):
-            # Just continue to the next entry if there's an error
-            with recoverer:
-                self._scan_command_or_entry()
+        while True:
+            start = self.__off
+            if start == len(self.__data):
+                if self.__fp is None:
+                    break
+                self._read_more(start)
+                continue
+            try:
+                # Just continue to the next entry if there's an error
+                with recoverer:
+                    self._scan_command_or_entry()
+                    self._flush_warnings()
+            except _NeedMore:
+                # Rescan this command or entry with more input
+                self.__warnings = []
+                self._read_more(start)
         recoverer.reraise()
         return self
 
     def get_entries(self):
         """Return the entry database.
 
-        The database is an ordered dictionary mapping from lower-cased
-        keys to Entry objects.
+        The database is a dictionary mapping from lower-cased keys to
+        Entry objects, in the order the entries were parsed.
         """
         return self.__entries
 
     def _fail(self, msg, off=None):
         if off is None:
             off = self.__off
+        self._flush_warnings()
         self.__pos_factory.offset_to_pos(off).raise_error(msg)
 
     def _warn(self, msg, off=None):
+        # Warnings are held until the current command or entry is
+        # done, since it may be rescanned if more input is needed
         if off is None:
             off = self.__off
-        self.__pos_factory.offset_to_pos(off).warn(msg)
+        self.__warnings.append((self.__pos_factory.offset_to_pos(off), msg))
+
+    def _flush_warnings(self):
+        for pos, msg in self.__warnings:
+            pos.warn(msg)
+        self.__warnings = []
 
     # Base parsers.  These are the only methods that directly
-    # manipulate self.__data.
+    # manipulate self.__data.  When parsing a file, these raise
+    # _NeedMore if their result could depend on input that hasn't
+    # been read yet.
+
+    def _read_more(self, off):
+        """Discard buffered input before off and read more input.
+
+        On return, self.__off is off's position in the new buffer.  At
+        the end of the file, this clears self.__fp.
+        """
+        chunk = self.__fp.read(READ_SIZE)
+        if not chunk:
+            self.__fp, self.__off = None, off
+            return
+        data = self.__data[off:] + chunk
+        self.__pos_factory = self.__pos_factory.rebase(off, data)
+        self.__data, self.__off = data, 0
 
-    def _try_tok(self, regexp, skip_space=True):
-        """Scan regexp followed by white space.
+    def _try_tok(self, regexp):
+        """Scan compiled regexp followed by white space.
 
         Returns the matched text, or None if the match failed."""
-        if isinstance(regexp, str):
-            regexp = re.compile(regexp)
-        m = regexp.match(self.__data, self.__off)
+        # This and _tok are called for almost every token, so they
+        # avoid calling other methods on the common path.
+        data = self.__data
+        m = regexp.match(data, self.__off)
+        # This is equivalent to eat_bib_white_space, except that we do
+        # it automatically after every token, whereas bibtex carefully
+        # and explicitly does it between every token.  Both the token
+        # and the white space after it may continue in the next chunk.
+        end = self.__off if m is None else SPACE_RE.match(data, m.end()).end()
+        if end == len(data) and self.__fp is not None:
+            raise _NeedMore()
         if m is None:
             return None
-        self.__off = m.end()
-        if skip_space:
-            self._skip_space()
+        self.__off = end
+        return m.group(0)
+
+    def _tok(self, regexp, fail=None):
+        """Scan compiled regexp followed by white space.
+
+        Returns the matched text, or fails with the given message."""
+        data = self.__data
+        m = regexp.match(data, self.__off)
+        end = self.__off if m is None else SPACE_RE.match(data, m.end()).end()
+        if end == len(data) and self.__fp is not None:
+            raise _NeedMore()
+        if m is None:
+            assert fail
+            self._fail(fail)
+        self.__off = end
         return m.group(0)
 
+    def _try_match(self, regexp):
+        """Scan compiled regexp followed by white space.
+
+        Returns the match object, or None if the match failed."""
+        data = self.__data
+        m = regexp.match(data, self.__off)
+        end = self.__off if m is None else SPACE_RE.match(data, m.end()).end()
+        if end == len(data) and self.__fp is not None:
+            raise _NeedMore()
+        if m is not None:
+            self.__off = end
+        return m
+
+    def _peek(self):
+        """Return the next character, or '' at the end of the input."""
+        if self.__off < len(self.__data):
+            return self.__data[self.__off]
+        if self.__fp is not None:
+            raise _NeedMore()
+        return ''
+
     def _scan_balanced_text(self, term):
-        """Scan brace-balanced text terminated with character term."""
-        start, level = self.__off, 0
-        while self.__off < len(self.__data):
-            char = self.__data[self.__off]
+        """Scan brace-balanced text terminated with character term.
+
+        This skips the opening delimiter at the current position."""
+        # Work in locals, since this is the innermost scanning loop
+        data, search = self.__data, BALANCED_SPECIAL_RE[term].search
+        start = off = self.__off + 1
+        level = 0
+        while True:
+            # Jump straight to the next brace or terminator
+            m = search(data, off)
+            if m is None:
+                if self.__fp is not None:
+                    raise _NeedMore()
+                break
+            off = m.end()
+            char = m.group(0)
             if level == 0 and char == term:
-                text = self.__data[start:self.__off]
-                self.__off += 1
-                self._skip_space()
-                return text
+                end = SPACE_RE.match(data, off).end()
+                if end == len(data) and self.__fp is not None:
+                    raise _NeedMore()
+                self.__off = end
+                return data[start:off - 1]
             elif char == '{':
                 level += 1
             elif char == '}':
                 level -= 1
                 if level < 0:
+                    self.__off = off - 1
                     self._fail('unexpected }')
-            self.__off += 1
+        self.__off = len(data)
         self._fail('unterminated string')
 
-    def _skip_space(self):
-        # This is equivalent to eat_bib_white_space, except that we do
-        # it automatically after every token, whereas bibtex carefully
-        # and explicitly does it between every token.
-        self.__off = SPACE_RE.match(self.__data, self.__off).end()
-
-    # Helpers
-
-    def _tok(self, regexp, fail=None):
-        """Scan token regexp or fail with the given message."""
-        res = self._try_tok(regexp)
-        if res is None:
-            assert fail
-            self._fail(fail)
-        return res
+    def _skip_noise(self):
+        # Skip to the next @ or the end of the buffered input.  Unlike
+        # other tokens, it's fine to do this in pieces.
+        self.__off = NOT_AT_RE.match(self.__data, self.__off).end()
+        return self.__off < len(self.__data)
 
     # Productions
 
@@ -201,13 +321,19 @@ class Parser:
         # See get_bib_command_or_entry_and_process
 
         # Skip to the next database entry or command
-        self._tok('[^@]*')
-        pos = self.__pos_factory.offset_to_pos(self.__off)
-        if not self._try_tok('@'):
+        if not self._skip_noise():
             return None
-
-        # Scan command or entry type
-        typ = self._scan_identifier().lower()
+        off = self.__off
+
+        # Scan command or entry type and opening delimiter
+        header = self._try_match(HEADER_RE)
+        if header is None:
+            # Scan the pieces separately to report the error (this
+            # must fail)
+            self._tok(AT_RE)
+            self._scan_identifier()
+        typ, left = header.groups()
+        typ = sys.intern(typ.lower())
 
         if typ == 'comment':
             # Believe it or not, BibTeX doesn't do anything with what
@@ -215,22 +341,24 @@ class Parser:
             # inter-entry noise.
             return None
 
-        left = self._tok('[{(]', 'expected { or ( after entry type')
-        right, right_re = (')', '\\)') if left == '(' else ('}', '}')
+        if not left:
+            self._fail('expected { or ( after entry type')
+        right, right_re = (')', RPAREN_RE) if left == '(' else ('}', RBRACE_RE)
+        expect_right = 'expected ' + right
 
         if typ == 'preamble':
             # Parse the preamble, but ignore it
             self._scan_field_value()
-            self._tok(right_re, 'expected '+right)
+            self._tok(right_re, expect_right)
             return None
 
         if typ == 'string':
-            name = self._scan_identifier().lower()
+            name = sys.intern(self._scan_identifier().lower())
             if name in self.__macros:
                 self._warn('macro `{}\' redefined'.format(name))
-            self._tok('=', 'expected = after string name')
+            self._tok(EQ_RE, 'expected = after string name')
             value = self._scan_field_value()
-            self._tok(right_re, 'expected '+right)
+            self._tok(right_re, expect_right)
             self.__macros[name] = value
             return None
 
@@ -241,68 +369,75 @@ class Parser:
             # The database key is anything up to a comma, white
             # space, or end-of-line (yes, the key can be empty,
             # and it can include a close paren)
-            key = self._tok('[^, \t\n]*')
+            key = self._tok(KEY_PAREN_RE)
         else:
             # The database key is anything up to comma, white
             # space, right brace, or end-of-line
-            key = self._tok('[^, \t}\n]*')
+            key = self._tok(KEY_BRACE_RE)
 
         # Scan entries (starting with comma or close after key)
         fields = []
         field_pos = {}
+        expect_comma = expect_right + ' or ,'
         while True:
             if self._try_tok(right_re):
                 break
-            self._tok(',', 'expected {} or ,'.format(right))
+            self._tok(COMMA_RE, expect_comma)
             if self._try_tok(right_re):
                 break
 
-            # Scan field name and value
+            # Scan field name and value.  A few field names are used
+            # over and over, so share one string for each.
             field_off = self.__off
-            field = self._scan_identifier().lower()
-            self._tok('=', 'expected = after field name')
+            field = sys.intern(self._scan_identifier().lower())
+            self._tok(EQ_RE, 'expected = after field name')
             value = self._scan_field_value()
 
             if field in field_pos:
-                pos.warn('repeated field `{}\''.format(field))
+                self._warn('repeated field `{}\''.format(field), off)
                 continue
 
             fields.append((field, value))
-            field_pos[field] = self.__pos_factory.offset_to_pos(field_off)
+            field_pos[field] = field_off
 
-        if key.lower() in self.__entries:
+        lkey = key.lower()
+        if lkey in self.__entries:
             self._fail('repeated entry')
-        self.__entries[key.lower()] = Entry(fields, typ, key, pos, field_pos)
+        self.__entries[lkey] = Entry(fields, typ, key, off, field_pos,
+                                     pos_factory=self.__pos_factory)
 
     def _scan_field_value(self):
         # See scan_and_store_the_field_value_and_eat_white
-        value = self._scan_field_piece()
-        while self._try_tok('#'):
-            value += self._scan_field_piece()
+        pieces = [self._scan_field_piece()]
+        while self._try_tok(HASH_RE):
+            pieces.append(self._scan_field_piece())
         # Compress spaces in the text.  Bibtex does this
         # (painstakingly) as it goes, but the final effect is the same
-        # (see check_for_and_compress_bib_white_space).
-        value = re.sub('[ \t\n]+', ' ', value)
-        # Strip leading and trailing space (literally just space, see
-        # @<Store the field value string@>)
-        return value.strip(' ')
+        # (see check_for_and_compress_bib_white_space).  Dropping
+        # empty words also strips leading and trailing space (see
+        # @<Store the field value string@>).  Only space, tab, and
+        # newline count as white space, so we can't use str.split().
+        value = ''.join(pieces).replace('\t', ' ').replace('\n', ' ')
+        return ' '.join(filter(None, value.split(' ')))
 
     def _scan_field_piece(self):
-        # See scan_a_field_token_and_eat_white
-        piece = self._try_tok('[0-9]+')
-        if piece is not None:
-            return piece
-        if self._try_tok('{', skip_space=False):
+        # See scan_a_field_token_and_eat_white.  The first character
+        # determines the kind of token.
+        char = self._peek()
+        if '0' <= char <= '9':
+            return self._tok(DIGITS_RE)
+        if char == '{':
             return self._scan_balanced_text('}')
-        if self._try_tok('"', skip_space=False):
+        if char == '"':
             return self._scan_balanced_text('"')
         opos = self.__off
         piece = self._try_tok(ID_RE)
         if piece is not None:
-            if piece.lower() not in self.__macros:
+            value = self.__macros.get(piece.lower())
+            if value is None:
                 self._warn('unknown macro `{}\''.format(piece), opos)
                 return ''
-            return self.__macros[piece.lower()]
+            return value
         self._fail('expected string, number, or macro name')
 
 class FieldError(KeyError):
@@ -315,16 +450,57 @@ class FieldError(KeyError):
 
 MONTH_MACROS = 'jan feb mar apr may jun jul aug sep oct nov dec'.split()
 
-class Entry(collections.OrderedDict):
+class _FieldPos(collections.abc.MutableMapping):
+    """A dictionary from field names to Pos instances.
+
+    Values may be given as character offsets, which are translated to
+    Pos instances by pos_factory the first time they are looked up.
+    This takes ownership of the field_pos dictionary.
+    """
+
+    def __init__(self, pos_factory, field_pos):
+        self.__pos_factory = pos_factory
+        self.__field_pos = field_pos
+
+    def __getitem__(self, field):
+        pos = self.__field_pos[field]
+        if isinstance(pos, int):
+            pos = self.__field_pos[field] = self.__pos_factory.offset_to_pos(pos)
+        return pos
+
+    def __setitem__(self, field, pos):
+        self.__field_pos[field] = pos
+
+    def __delitem__(self, field):
+        del self.__field_pos[field]
+
+    def __iter__(self):
+        return iter(self.__field_pos)
+
+    def __len__(self):
+        return len(self.__field_pos)
+
+    def __repr__(self):
+        return repr(self.__field_pos)
+
+    def __reduce__(self):
+        # Pickle and deepcopy as a plain dictionary of Pos instances,
+        # rather than dragging along pos_factory and its whole input
+        return (dict, (dict(self),))
+
+    def copy(self):
+        return self.__class__(self.__pos_factory, dict(self.__field_pos))
+
+class Entry(dict):
     """An entry in a BibTeX database.
 
-    This is an ordered dictionary of fields, plus some additional
-    properties: typ gives the type of the entry, such as "journal",
-    canonicalized to lower case.  key gives the database entry key
-    (case is preserved, but should be ignored for comparisons).  pos
-    is a messages.Pos instance giving the position of this entry in
-    the database file.  field_pos is a simple dictionary from field
-    names to message.Pos instances.
+    This is a dictionary of fields (in the order they were given),
+    plus some additional properties: typ gives the type of the entry,
+    such as "journal", canonicalized to lower case.  key gives the
+    database entry key (case is preserved, but should be ignored for
+    comparisons).  pos is a messages.Pos instance giving the position
+    of this entry in the database file.  field_pos is a dictionary from
+    field names to message.Pos instances.
 
     Field values are as they would be seen by a .bst file: white space
     is cleaned up, but they retain macros, BibTeX-style accents, etc.
@@ -332,12 +508,42 @@ class Entry(collections.OrderedDict):
     Unicode strings.
     """
 
-    def __init__(self, fields, typ=None, key=None, pos=None, field_pos=None):
+    def __init__(self, fields, typ=None, key=None, pos=None, field_pos=None,
+                 *, pos_factory=None):
+        """Create an entry.
+
+        If pos_factory is not None, pos and the values of field_pos
+        may be character offsets, which will be translated to Pos
+        instances by pos_factory when they are first used.  In this
+        case, the entry takes ownership of field_pos.
+        """
         super().__init__(fields)
-        self.typ, self.key, self.pos, self.field_pos = typ, key, pos, field_pos
+        if pos_factory is not None and field_pos is not None:
+            field_pos = _FieldPos(pos_factory, field_pos)
+        self.typ, self.key, self.field_pos = typ, key, field_pos
+        self.__pos, self.__pos_factory = pos, pos_factory
+
+    @property
+    def pos(self):
+        if self.__pos_factory is not None and isinstance(self.__pos, int):
+            self.__pos = self.__pos_factory.offset_to_pos(self.__pos)
+        return self.__pos
+
+    @pos.setter
+    def pos(self, pos):
+        self.__pos = pos
 
     def copy(self):
-        return self.__class__(self, self.typ, self.key, self.pos, self.field_pos)
+        # Translate any offsets now so the copy does not keep the
+        # PosFactory (and with it the entire input) alive
+        field_pos = self.field_pos
+        if field_pos is not None:
+            field_pos = dict(field_pos)
+        return self.__class__(self, self.typ, self.key, self.pos, field_pos)
+
+    def __reduce__(self):
+        return (self.__class__,
+                (dict(self), self.typ, self.key, self.pos, self.field_pos))
 
     def __str__(self):
         return '`{}\' at {}'.format(self.key, self.pos)
@@ -380,13 +586,8 @@ class Entry(collections.OrderedDict):
             elif wrap_width is None:
                 lines.append(start + '{' + v + '},')
             else:
-                lines.append(textwrap.fill(
-                    v, width=wrap_width,
-                    # Keep whitespace formatting as it is
-                    expand_tabs=False, replace_whitespace=False,
-                    # Don't break long things like URLs
-                    break_long_words=False, break_on_hyphens=False,
-                    initial_indent=start + '{', subsequent_indent='    ') + '},')
+                _wrap(lines, v, wrap_width, start + '{', '    ')
+                lines[-1] += '},'
         lines.append('}')
         return '\n'.join(lines)
 
@@ -449,6 +650,26 @@ class Entry(collections.OrderedDict):
         from .algo import parse_month
         return parse_month(self[field], pos=self.field_pos[field])
 
+def _wrap(out, text, width, initial_indent, subsequent_indent):
+    """Greedily word wrap text to width columns, appending lines to out.
+
+    This is like textwrap.wrap, but much faster.  Lines are only broken
+    at spaces (so long things like URLs and hyphenated words are never
+    split).  Runs of spaces are collapsed to a single space, but other
+    characters, including other white space, are kept as they are.
+    """
+    line, empty = initial_indent, True
+    for word in filter(None, text.split(' ')):
+        if empty:
+            line += word
+            empty = False
+        elif len(line) + 1 + len(word) <= width:
+            line += ' ' + word
+        else:
+            out.append(line)
+            line = subsequent_indent + word
+    out.append(line)
+
 def resolve_crossrefs(db, min_crossrefs=None):
     """Resolve cross-referenced entries in db.
 
@@ -474,7 +695,7 @@ def resolve_crossrefs(db, min_crossrefs=None):
 
     key_idx = {k: i for i, k in enumerate(db)}
     recoverer = messages.InputErrorRecoverer()
-    ndb = collections.OrderedDict()
+    ndb = {}
     for entry_idx, (key, entry) in enumerate(db.items()):
         crossref = entry.get('crossref')
         if crossref is None:
@@ -31,23 +31,46 @@ Pos.unknown = Pos('<unknown>', 1, 0, None)
 class PosFactory:
     """A factory that translates character offsets to Pos instances."""
 
-    def __init__(self, fname, string, log_fp=None):
+    def __init__(self, fname, string, log_fp=None, *, line=1, col=0):
+        """Create a factory for offsets in string.
+
+        line and col give the position of the beginning of string.
+        """
         self.__fname = fname
         self.__string = string
         self.__log_fp = log_fp
-        self.__cache = (0, 1, 0)
+        self.__start_col = col
+        self.__cache = (0, line, col)
+
+    def rebase(self, offset, string):
+        """Return a PosFactory for string, which continues from offset.
+
+        Offset 0 in string must correspond to offset in this factory's
+        string.  This is useful for tracking positions in a buffer that
+        slides through a file.
+        """
+        pos = self.offset_to_pos(offset)
+        return PosFactory(self.__fname, string, self.__log_fp,
+                          line=pos.line, col=pos.col)
 
     def offset_to_pos(self, offset):
+        # Work forward or backward from the last offset, so the cost
+        # is proportional to the distance between lookups
         last_off, last_line, last_col = self.__cache
-        if last_off < offset:
-            last_off, last_line, last_col = 0, 1, 0
-
-        line = self.__string.count('\n', last_off, offset) + last_line
-        lastnl = self.__string.rfind('\n', last_off, offset)
-        if lastnl == -1:
-            col = last_col + (offset - last_off)
+        if last_off <= offset:
+            line = last_line + self.__string.count('\n', last_off, offset)
+            lastnl = self.__string.rfind('\n', last_off, offset)
+            if lastnl == -1:
+                col = last_col + (offset - last_off)
+            else:
+                col = offset - lastnl - 1
         else:
-            col = offset - lastnl - 1
+            line = last_line - self.__string.count('\n', offset, last_off)
+            lastnl = self.__string.rfind('\n', 0, offset)
+            if lastnl == -1:
+                col = self.__start_col + offset
+            else:
+                col = offset - lastnl - 1
         self.__cache = (offset, line, col)
 
         return Pos(self.__fname, line, col, self.__log_fp)
@@ -1,6 +1,8 @@
 import unittest
 import collections
+import copy
 import io
+import pickle
 from .bib import *
 from .algo import *
 from .messages import *
@@ -40,6 +42,29 @@ class BibParserTest(unittest.TestCase):
         self.__test_parse(
             '@misc{x, title={  a\t  b\n  c  }}',
             [ent('misc', 'x', od('title', 'a b c'))])
+        # Only space, tab, and newline are white space
+        self.__test_parse(
+            '@misc{x, title={\xa0a\r  b\xa0}}',
+            [ent('misc', 'x', od('title', '\xa0a\r b\xa0'))])
+
+    def test_trailing_space(self):
+        self.__test_parse(
+            '@misc{x \t\n, title={a \t\nb \n} \t\n}',
+            [ent('misc', 'x', od('title', 'a b'))])
+
+    def test_unexpected_brace(self):
+        # Parsing should resume after the bad }, so the @ in the string
+        # isn't taken as the start of an entry
+        log = io.StringIO()
+        parser = Parser()
+        with self.assertRaises(InputError) as ar:
+            parser.parse('@misc{x, note = "mail a@b.c }"}\n@misc{y}',
+                         name='<test>', log_fp=log)
+        self.assertEqual(1, len(ar.exception.args[0]))
+        self.assertEqual(log.getvalue(),
+                         '<test>:1:28: error: unexpected }\n')
+        self.assertEqual(list(parser.get_entries().values()),
+                         [ent('misc', 'y', od())])
 
     def test_funny_keys(self):
         self.__test_parse(
@@ -59,6 +84,11 @@ class BibParserTest(unittest.TestCase):
         self.__test_parse(
             '@string{foo = {a}}\n@misc{x, title = foo # "b" # foo # 2}',
             [ent('misc', 'x', od('title', 'aba2'))])
+        parser = Parser()
+        parser.string('FOO', 'a')
+        self.assertEqual(
+            list(parser.parse('@misc{x, title = Foo}').get_entries().values()),
+            [ent('misc', 'x', od('title', 'a'))])
 
     def test_comment(self):
         self.__test_parse(
@@ -66,6 +96,39 @@ class BibParserTest(unittest.TestCase):
             '@comment{abc@misc{x}',
             [ent('misc', 'x', od())])
 
+    def test_positions(self):
+        ents = Parser().parse('@misc{x, a = 1}\n  @misc{y,\n b = 2, c = 3}',
+                              name='<test>').get_entries()
+        self.assertEqual(str(ents['y'].pos), '<test>:2:2')
+        self.assertEqual(str(ents['y'].field_pos['c']), '<test>:3:8')
+        self.assertEqual(str(ents['y'].field_pos['b']), '<test>:3:1')
+        self.assertEqual(str(ents['x'].field_pos['a']), '<test>:1:9')
+        self.assertEqual(str(ents['x'].pos), '<test>:1:0')
+
+    def test_stream(self):
+        # Parsing a file a few characters at a time should give the
+        # same entries, positions, and messages as parsing a string
+        class Trickle(io.StringIO):
+            def read(self, size=-1):
+                return super().read(3)
+        def parse(src):
+            log = io.StringIO()
+            try:
+                ents = Parser().parse(src, name='<test>',
+                                      log_fp=log).get_entries()
+            except InputError:
+                ents = {}
+            return ([(ent, str(ent.pos), sorted(map(str, ent.field_pos.values())))
+                     for ent in ents.values()], log.getvalue())
+        for string in [
+                '@string{s = "x"}\n@string{s = s # {y}}\n'
+                '@misc{a, title = s # zz, title = 1}\n'
+                'noise @comment{ @misc(b, title = {a{b}c} # "d{\"}e")',
+                '@misc{a, title = "x}\n@misc{b}',
+                '@misc{a, title = {x}\n@misc{b}',
+                '@misc{k}\n@misc{k}   \n\n  @misc{z}']:
+            self.assertEqual(parse(Trickle(string)), parse(string))
+
 class EntryTest(unittest.TestCase):
     def test_to_bib(self):
         entry = Entry([('author', 'An Author'),
@@ -92,6 +155,20 @@ class EntryTest(unittest.TestCase):
   year         = 2013,
 }''')
 
+    def test_to_bib_wrap(self):
+        entry = Entry([('note', ''), ('url', 'http://' + 'x'*70),
+                       ('title', 'a b\tc'), ('author', '\xa0a\r b\xa0')],
+                      typ='misc', key='key')
+        self.assertEqual(
+            entry.to_bib(wrap_width=30),
+            '''\
+@misc{key,
+  note         = {},
+  url          = {http://''' + 'x'*70 + '''},
+  title        = {a b\tc},
+  author       = {\xa0a\r b\xa0},
+}''')
+
     def test_month_num(self):
         def test(string, expect):
             entry = Entry([('month', string)], field_pos={'month': Pos.unknown})
@@ -123,6 +200,26 @@ class EntryTest(unittest.TestCase):
         self.assertRaises(InputError, test, None, 'jan', None)
         self.assertRaises(InputError, test, '2013', 'foo', None)
 
+    def test_pos(self):
+        # Without a PosFactory, pos is whatever the caller gave
+        entry = Entry([('a', 'b')], 'misc', 'k', 0)
+        self.assertEqual(entry.pos, 0)
+        self.assertEqual(str(entry), "`k' at 0")
+
+    def test_pickle(self):
+        src = '@misc{k, a = {x},\n  b = {y}}' + ' '*10000
+        entry = Parser().parse(src).get_entries()['k']
+        for copied in [entry.copy(), copy.deepcopy(entry),
+                       pickle.loads(pickle.dumps(entry))]:
+            self.assertEqual(copied, entry)
+            self.assertEqual(list(copied.items()), list(entry.items()))
+            self.assertEqual(copied.pos, Pos('<string>', 1, 0, None))
+            self.assertEqual(dict(copied.field_pos),
+                             {'a': Pos('<string>', 1, 9, None),
+                              'b': Pos('<string>', 2, 2, None)})
+        # The input the entry was parsed from should not be pickled
+        self.assertLess(len(pickle.dumps(entry)), 1000)
+
 class CrossRefTest(unittest.TestCase):
     def setUp(self):
         self.parser = Parser().parse("""\
@@ -138,6 +235,12 @@ class CrossRefTest(unittest.TestCase):
                                            ('booktitle', 'Book title 2')]))],
             list(db.items()))
 
+    def test_unmodified(self):
+        db = self.parser.get_entries()
+        resolve_crossrefs(db)
+        self.assertNotIn('booktitle', db['ent1'])
+        self.assertNotIn('booktitle', db['ent1'].field_pos)
+
     def test_min_crossrefs(self):
         db = resolve_crossrefs(self.parser.get_entries(), min_crossrefs=1)
         self.assertEqual(
@@ -170,6 +273,17 @@ class CrossRefTest(unittest.TestCase):
             resolve_crossrefs(self.parser.get_entries())
         self.assertEqual(1, len(ar.exception.args[0]))
 
+class PosFactoryTest(unittest.TestCase):
+    def test_offset_to_pos(self):
+        string = 'ab\ncd\n\nefg'
+        factory = PosFactory('<test>', string)
+        expect = {0: (1, 0), 1: (1, 1), 3: (2, 0), 4: (2, 1),
+                  6: (3, 0), 7: (4, 0), 9: (4, 2)}
+        # Forward, backward, and repeated offsets should agree
+        for off in [0, 1, 3, 4, 6, 7, 9, 4, 4, 0, 9, 7]:
+            pos = factory.offset_to_pos(off)
+            self.assertEqual((pos.line, pos.col), expect[off])
+
 class NameParserTest(unittest.TestCase):
     def test_first_char(self):
         p = algo.NameParser()